@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import AsyncIterator, Callable
+
+# ---------------------------------------------------------------------
+# LRU Cache
+# ---------------------------------------------------------------------
+
+class LRUCache:
+    """Small exact-match LRU cache.
+
+    functools.lru_cache can't memoize coroutine results, so the async chains
+    store their finished answers here instead. Safe to share with the worker
+    threads used by asyncio.to_thread.
+    """
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def prompt_cache_key(system_prompt: str, query: str) -> tuple:
+    """Cache key for an LLM call: (system prompt hash, normalized user query)"""
+    prompt_hash = hashlib.sha1(system_prompt.encode()).hexdigest()
+    return prompt_hash, normalize_query(query)
+
+# ---------------------------------------------------------------------
+# Semantic Cache
+# ---------------------------------------------------------------------
+
+class SemanticCache:
+    """LRU cache that matches near-duplicate queries by embedding.
+
+    get_similar returns the value of the stored entry with the highest cosine
+    similarity to the given embedding, if it clears `threshold`. Keys only
+    identify entries for overwrites and eviction. Embeddings must be
+    L2-normalized.
+    """
+
+    def __init__(self, threshold: float, maxsize: int = 1024):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (embedding, value)
+        # Stacked embeddings and their keys, rebuilt lazily after writes
+        self._matrix = None
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def get_similar(self, embedding):
+        with self._lock:
+            if not self._data:
+                return None
+            if self._matrix is None:
+                self._keys = list(self._data)
+                self._matrix = np.stack([self._data[key][0] for key in self._keys])
+
+            scores = self._matrix @ np.asarray(embedding, dtype=np.float32)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            key = self._keys[best]
+            self._data.move_to_end(key)
+            return self._data[key][1]
+
+    def set(self, key, embedding, value):
+        with self._lock:
+            self._data[key] = (np.asarray(embedding, dtype=np.float32), value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._matrix = None
+            self._keys = []
+
+    def __len__(self):
+        return len(self._data)
+
+# ---------------------------------------------------------------------
+# Request Coalescing
+# ---------------------------------------------------------------------
+
+class SingleFlight:
+    """Coalesces identical in-flight chain calls into one upstream request.
+
+    The first caller for a query streams the answer as usual; callers that
+    arrive while it is still running wait for it and get the full text in
+    one chunk. The LRU caches cover repeats once the answer is finished.
+    Only touched from the event loop thread, so no lock is needed.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def stream(
+        self, query: str, make_stream: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        key = hashlib.sha1(normalize_query(query).encode()).hexdigest()
+
+        leader = self._inflight.get(key)
+        if leader is not None:
+            # shield: one follower being cancelled must not cancel the others
+            answer = await asyncio.shield(leader)
+            if answer is not None:
+                yield answer
+                return
+            # The leader was abandoned mid-stream, so do the work ourselves
+            async for chunk in make_stream():
+                yield chunk
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        answer = None
+        try:
+            chunks = []
+            async for chunk in make_stream():
+                chunks.append(chunk)
+                yield chunk
+            answer = "".join(chunks)
+        finally:
+            del self._inflight[key]
+            future.set_result(answer)
@@ -0,0 +1,137 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from pathlib import Path
+from _cache import LRUCache
+
+# ---------------------------------------------------------------------
+# Setup
+# ---------------------------------------------------------------------
+
+model_name = "sentence-transformers/all-MiniLM-L6-v2"
+max_seq_length = 256
+embedding_dim = 384
+
+# INT8 copy of the fp32 graph for CPU inference, built on first use
+quantized_model_path = Path("./onnx_minilm/model_int8.onnx")
+
+# ---------------------------------------------------------------------
+# Quantization
+# ---------------------------------------------------------------------
+
+def get_quantized_model() -> str:
+    """Return the INT8 dynamic-quantized MiniLM graph, creating it once"""
+    if not quantized_model_path.exists():
+        from huggingface_hub import hf_hub_download
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized_model_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and swap it in, so a killed process never
+        # leaves a truncated model behind that later runs would pick up
+        tmp_path = quantized_model_path.with_name(f"{quantized_model_path.stem}.{os.getpid()}.tmp.onnx")
+        try:
+            quantize_dynamic(
+                hf_hub_download(model_name, "onnx/model.onnx"),
+                tmp_path,
+                weight_type=QuantType.QInt8
+            )
+            os.replace(tmp_path, quantized_model_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return str(quantized_model_path)
+
+# ---------------------------------------------------------------------
+# Embedding Function
+# ---------------------------------------------------------------------
+
+class FastMiniLMEF:
+    """all-MiniLM-L6-v2 served by ONNX Runtime instead of eager PyTorch.
+
+    Uses the ONNX exports published in the model repo: the fp16 graph on
+    CUDA when onnxruntime-gpu is installed, otherwise an INT8 dynamic-quantized
+    graph on CPU (VNNI int8 dot products where the CPU has them).
+    Pooling matches sentence-transformers (mean pooling + L2 normalization).
+    ONNX Runtime and the tokenizer are imported here rather than at module
+    load to keep cold starts cheap.
+    """
+
+    def __init__(self, batch_size: int = 64, cache_size: int = 10_000):
+        import onnxruntime as ort
+        from huggingface_hub import hf_hub_download
+        from tokenizers import Tokenizer
+
+        self.batch_size = batch_size
+        # Per-text embedding cache keyed by SHA1 of the text
+        self.cache = LRUCache(maxsize=cache_size)
+
+        if "CUDAExecutionProvider" in ort.get_available_providers():
+            providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+            model_path = hf_hub_download(model_name, "onnx/model_O4.onnx")
+        else:
+            providers = ["CPUExecutionProvider"]
+            model_path = get_quantized_model()
+
+        self.session = ort.InferenceSession(model_path, providers=providers)
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_pretrained(model_name)
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Encode texts into an (N, 384) float32 matrix of unit vectors"""
+        keys = [hashlib.sha1(t.encode()).digest() for t in texts]
+        embeddings = np.empty((len(texts), embedding_dim), dtype=np.float32)
+
+        # Fill hits from the cache; collect each distinct miss once
+        misses = {}
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                embeddings[i] = cached
+            else:
+                misses.setdefault(key, []).append(i)
+
+        if misses:
+            miss_texts = [texts[rows[0]] for rows in misses.values()]
+            miss_embeddings = np.concatenate([
+                self._encode_batch(miss_texts[start:start + self.batch_size])
+                for start in range(0, len(miss_texts), self.batch_size)
+            ])
+            for (key, rows), embedding in zip(misses.items(), miss_embeddings):
+                self.cache.set(key, embedding)
+                embeddings[rows] = embedding
+
+        return embeddings
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0].astype(np.float32)
+
+        # Mean-pool over real (non-padding) tokens, then L2-normalize
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+
+
+_embedding_function = None
+_embedding_function_lock = threading.Lock()
+
+
+def get_embedding_function() -> FastMiniLMEF:
+    """Process-wide FastMiniLMEF, loaded on first use and shared by all chains"""
+    global _embedding_function
+    # Callers embed from to_thread workers, so two sessions can race here;
+    # the lock keeps it to one ORT session and one quantization run
+    with _embedding_function_lock:
+        if _embedding_function is None:
+            _embedding_function = FastMiniLMEF()
+        return _embedding_function
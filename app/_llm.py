@@ -0,0 +1,42 @@
+import os
+import asyncio
+from typing import AsyncIterator
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAioHttpClient
+
+# ---------------------------------------------------------------------
+# Shared OpenAI Client
+# ---------------------------------------------------------------------
+load_dotenv()
+
+# One client for chitchat, FAQ and SQL chains. The aiohttp transport holds
+# up far better under concurrency than openai-python's default httpx one.
+# OPENAI_BASE_URL can point at any OpenAI-compatible server (e.g. a local vLLM).
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL"),
+    http_client=DefaultAioHttpClient(
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+    ),
+)
+
+# Caps in-flight OpenAI requests so concurrent users stay under rate limits
+llm_semaphore = asyncio.Semaphore(50)
+
+# ---------------------------------------------------------------------
+# Streaming Helpers
+# ---------------------------------------------------------------------
+
+async def stream_text(model: str, input: list[dict]) -> AsyncIterator[str]:
+    """Stream the output text of a Responses API call as it is generated"""
+    async with llm_semaphore:
+        async with client.responses.stream(model=model, input=input) as stream:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+
+
+async def collect(stream: AsyncIterator[str]) -> str:
+    """Drain a chain's text stream into one string"""
+    return "".join([chunk async for chunk in stream])
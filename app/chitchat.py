@@ -1,14 +1,23 @@
 import os
+import re
+import asyncio
 from datetime import datetime
-from dotenv import load_dotenv
-from openai import OpenAI
+from typing import AsyncIterator
+from _llm import collect, stream_text
+from _cache import LRUCache, SingleFlight, prompt_cache_key
 
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
-load_dotenv()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Small talk doesn't need a reasoning model; a fast small one keeps turns snappy
+CHITCHAT_MODEL = os.getenv("CHITCHAT_MODEL", "gpt-4o-mini")
+
+response_cache = LRUCache(maxsize=2048)
+inflight = SingleFlight()
+
+# Questions about the clock must see the current time, so they skip the cache
+_CLOCK_RE = re.compile(r"\b(time|clock|hours?)\b", re.IGNORECASE)
 
 # ---------------------------------------------------------------------
 # System Prompt
@@ -49,8 +58,26 @@ def get_current_datetime_info():
 # Chitchat Chain
 # ---------------------------------------------------------------------
 
-def chitchat_chain(query: str) -> str:
+async def chitchat_chain(query: str) -> AsyncIterator[str]:
+    # Identical queries arriving together share one LLM call
+    async for chunk in inflight.stream(query, lambda: _chitchat_chain(query)):
+        yield chunk
+
+
+async def _chitchat_chain(query: str) -> AsyncIterator[str]:
     datetime_info = get_current_datetime_info()
+
+    # Key on the date only, so cached answers survive the clock ticking over
+    cache_key = None
+    if not _CLOCK_RE.search(query):
+        cache_key = prompt_cache_key(
+            f"{chitchat_system_prompt}\n\nCurrent date: {datetime_info['date']}", query
+        )
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
     context_note = (
         f"\n\nCurrent date and time: "
         f"{datetime_info['date']}, {datetime_info['time']}"
@@ -62,14 +89,17 @@ def chitchat_chain(query: str) -> str:
     ]
 
     try:
-        response = client.responses.create(
-            model="gpt-5-mini",
-            input=messages
-        )
-        return response.output_text
+        chunks = []
+        async for delta in stream_text(model=CHITCHAT_MODEL, input=messages):
+            chunks.append(delta)
+            yield delta
+        answer = "".join(chunks)
+        # An empty stream is not an answer; caching it would replay a blank reply
+        if answer and cache_key is not None:
+            response_cache.set(cache_key, answer)
 
     except Exception as e:
-        return f"I'm sorry, I ran into an error. Please try again."
+        yield f"I'm sorry, I ran into an error. Please try again."
 
 # ---------------------------------------------------------------------
 # Local Testing
@@ -84,7 +114,10 @@ if __name__ == "__main__":
         "What are the latest fashion trends?",
     ]
 
-    for query in test_queries:
+    async def main():
+        return await asyncio.gather(*[collect(chitchat_chain(q)) for q in test_queries])
+
+    for query, answer in zip(test_queries, asyncio.run(main())):
         print("\nQuery:", query)
-        print("Answer:", chitchat_chain(query))
+        print("Answer:", answer)
         print("-" * 80)
@@ -1,86 +1,203 @@
 import os
-import chromadb
-from chromadb.utils import embedding_functions
-import pandas as pd
-from dotenv import load_dotenv
+import asyncio
+import functools
+import json
+import textwrap
+import numpy as np
 from pathlib import Path
-from openai import OpenAI
+from typing import AsyncIterator
+from _llm import client, collect, stream_text
+from _cache import SemanticCache, SingleFlight, normalize_query
+from _embeddings import get_embedding_function
 
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
-load_dotenv()
+faqs_path = Path(__file__).parent / "resources/faq_data.csv"
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+FAQ_MODEL = os.getenv("FAQ_MODEL", "gpt-5-mini")
 
-faqs_path = Path(__file__).parent / "resources/faq_data.csv"
+# Flat FAQ index: an (N, 384) int8 matrix of quantized unit-length question
+# embeddings plus the matching Q&A pairs and the quantization scale. The
+# corpus is small, so a brute-force dot product beats any ANN index.
+faq_index_dir = Path("./faq_index")
+faq_emb_path = faq_index_dir / "faq_emb_i8.npy"
+faq_meta_path = faq_index_dir / "faq_meta.json"
+top_k = 3
 
-# Embedding function
-ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
+# Context trimming: keep hits within 1.2x the best cosine distance, cap each
+# answer's length, and keep the whole context under a token budget
+relative_distance_cutoff = 1.2
+max_answer_chars = 400
+context_token_budget = 800
+
+# Semantic cache of generated answers, keyed by the question's embedding
+# (cosine >= 0.975, i.e. squared L2 distance < 0.05 between unit vectors)
+response_cache = SemanticCache(threshold=0.975, maxsize=2048)
+inflight = SingleFlight()
+
+# ---------------------------------------------------------------------
+# Embeddings
+# ---------------------------------------------------------------------
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Batch-encode texts into L2-normalized embeddings"""
+    return get_embedding_function().encode(texts)
+
+
+def embed_query(query: str) -> np.ndarray:
+    return embed([query])[0]
 
-# Persistent ChromaDB client
-chroma_client = chromadb.PersistentClient(
-    path="./chroma_db"
-)
 
-collection_name_faq = "faqs"
+def quantize_int8(embeddings: np.ndarray, axis: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 quantization: values * scale rounded into [-127, 127]"""
+    scale = 127 / np.max(np.abs(embeddings), axis=axis, keepdims=axis is not None)
+    return np.round(embeddings * scale).astype(np.int8), scale
 
 # ---------------------------------------------------------------------
 # Ingestion
 # ---------------------------------------------------------------------
 
 def ingest_faq_data(path: Path):
-    """Ingest FAQ data into ChromaDB (runs only once)"""
-    existing_collections = [c.name for c in chroma_client.list_collections()]
-    if collection_name_faq in existing_collections:
+    """Build the flat FAQ index on disk (runs only once)"""
+    if faq_emb_path.exists() and faq_meta_path.exists():
         return
 
-    print("Ingesting FAQ data into ChromaDB...")
+    print("Building FAQ index...")
 
-    collection = chroma_client.create_collection(
-        name=collection_name_faq,
-        embedding_function=ef
-    )
+    import pandas as pd
 
     df = pd.read_csv(path)
-    documents = df["question"].tolist()
-    metadatas = [{"answer": ans} for ans in df["answer"].tolist()]
-    ids = [f"faq_{i}" for i in range(len(documents))]
-
-    collection.add(
-        documents=documents,
-        metadatas=metadatas,
-        ids=ids
-    )
+    metadatas = [
+        {"question": question, "answer": answer}
+        for question, answer in zip(df["question"], df["answer"])
+    ]
+    embeddings, scale = quantize_int8(embed(df["question"].tolist()))
+
+    faq_index_dir.mkdir(parents=True, exist_ok=True)
+    np.save(faq_emb_path, embeddings)
+    faq_meta_path.write_text(json.dumps({"scale": float(scale), "faqs": metadatas}))
+
+    print(f"FAQ index written to: {faq_index_dir}")
 
 
-    print(f"FAQ data ingested into collection: {collection_name_faq}")
+@functools.cache
+def _load_faq_index() -> tuple[np.ndarray, float, list[dict]]:
+    """Load the int8 FAQ embeddings, their scale and the Q&A pairs once"""
+    embeddings = np.load(faq_emb_path)
+    meta = json.loads(faq_meta_path.read_text())
+    return embeddings, meta["scale"], meta["faqs"]
 
 # ---------------------------------------------------------------------
 # Retrieval
 # ---------------------------------------------------------------------
 
-def get_relevant_qa(query: str):
-    """Retrieve relevant Q&A from ChromaDB"""
-    collection = chroma_client.get_collection(
-        name=collection_name_faq,
-        embedding_function=ef
-    )
+def search_faq(query_embeddings: np.ndarray, k: int = top_k) -> list[list[dict]]:
+    """Top-k FAQ entries for each query embedding, best match first"""
+    embeddings, scale, metadatas = _load_faq_index()
+    query_embeddings = np.atleast_2d(query_embeddings)
+    if not metadatas:
+        return [[] for _ in query_embeddings]
 
-    return collection.query(
-        query_texts=[query],
-        n_results=3
-    )
+    # int8 x int8 dot products accumulated in int32, then rescaled back to
+    # (approximate) cosine similarity, since both sides are unit vectors
+    query_i8, query_scale = quantize_int8(query_embeddings, axis=1)
+    scores = np.matmul(query_i8, embeddings.T, dtype=np.int32) / (query_scale * scale)
+    k = min(k, len(metadatas))
+
+    results = []
+    for row in scores:
+        top = np.argpartition(-row, k - 1)[:k]
+        top = top[np.argsort(-row[top])]
+        results.append([{**metadatas[i], "score": float(row[i])} for i in top])
+    return results
+
+
+def get_relevant_qa(query_embedding: np.ndarray) -> list[dict]:
+    """Retrieve relevant Q&A from the FAQ index"""
+    return search_faq(query_embedding)[0]
+
+
+@functools.cache
+def _get_tokenizer():
+    import tiktoken
+
+    # gpt-4o / gpt-5 family encoding
+    return tiktoken.get_encoding("o200k_base")
+
+
+def trim_context(relevant_qa: list[dict]) -> list[dict]:
+    """Drop weak and duplicate hits and shorten answers before prompting"""
+    if not relevant_qa:
+        return []
+
+    # int8 scores can overshoot 1.0 slightly, so clamp distances at zero
+    distances = [max(0.0, 1.0 - qa["score"]) for qa in relevant_qa]
+    cutoff = relative_distance_cutoff * min(distances)
+
+    tokenizer = _get_tokenizer()
+    trimmed, seen, tokens = [], set(), 0
+    for qa, distance in zip(relevant_qa, distances):
+        if distance > cutoff:
+            continue
+
+        answer = textwrap.shorten(qa["answer"], width=max_answer_chars, placeholder="...")
+        prefix = " ".join(answer.lower().split())[:80]
+        if prefix in seen:
+            continue
+
+        answer_tokens = len(tokenizer.encode(answer))
+        if trimmed and tokens + answer_tokens > context_token_budget:
+            break
+
+        seen.add(prefix)
+        tokens += answer_tokens
+        trimmed.append({**qa, "answer": answer})
+    return trimmed
+
+
+def retrieve_context(query_embedding: np.ndarray) -> list[dict]:
+    """Retrieve relevant Q&A and trim them for the prompt"""
+    return trim_context(get_relevant_qa(query_embedding))
+
+# ---------------------------------------------------------------------
+# Response Cache
+# ---------------------------------------------------------------------
+
+def get_cached_answer(query_embedding: np.ndarray) -> str | None:
+    """Return a previously generated answer for a near-identical question"""
+    return response_cache.get_similar(query_embedding)
+
+
+def cache_answer(query: str, query_embedding: np.ndarray, answer: str):
+    """Store a generated answer in the semantic response cache"""
+    response_cache.set(normalize_query(query), query_embedding, answer)
 
 # ---------------------------------------------------------------------
 # Answer Generation
 # ---------------------------------------------------------------------
 
-def generate_answer(query: str, context: str) -> str:
-    """Generate answer using OpenAI based on retrieved context"""
+ANSWER_ERROR_MESSAGE = (
+    "I apologize, but I encountered an error while answering your question. "
+    "Please try again."
+)
 
+NO_CONTEXT_MESSAGE = (
+    "I don't have specific information about that. "
+    "Please contact our support team or try rephrasing your question."
+)
+
+# Batch API polling interval in seconds
+batch_poll_interval = 30
+
+
+def build_context(metadatas: list[dict]) -> str:
+    """Join the answers of the retrieved FAQs into one context string"""
+    return " ".join(meta.get("answer", "") for meta in metadatas)
+
+
+def build_answer_messages(query: str, context: str) -> list[dict]:
+    """Build the Responses API input for answering a question from context"""
     prompt = f"""You are a helpful e-commerce customer service assistant.
 Answer the question based ONLY on the provided context.
 
@@ -99,50 +216,147 @@ INSTRUCTIONS:
 - Keep answers brief (3–4 sentences)
 """
 
-    messages = [
+    return [
         {"role": "system", "content": "You are a helpful e-commerce customer service assistant."},
         {"role": "user", "content": prompt},
     ]
 
-    try:
-        response = client.responses.create(
-            model="gpt-5-mini",
-            input=messages
-        )
-        return response.output_text
 
-    except Exception:
-        return (
-            "I apologize, but I encountered an error while answering your question. "
-            "Please try again."
-        )
+async def generate_answer(query: str, context: str) -> AsyncIterator[str]:
+    """Stream an answer from OpenAI based on retrieved context"""
+    messages = build_answer_messages(query, context)
+
+    async for delta in stream_text(model=FAQ_MODEL, input=messages):
+        yield delta
 
 # ---------------------------------------------------------------------
 # Public Chain
 # ---------------------------------------------------------------------
 
-def faq_chain(query: str) -> str:
-    """Main FAQ chain: retrieve context and generate answer"""
-    try:
-        result = get_relevant_qa(query)
+async def faq_chain(query: str) -> AsyncIterator[str]:
+    """Main FAQ chain: retrieve context and stream the generated answer"""
+    # Identical queries arriving together share one retrieval + LLM call
+    async for chunk in inflight.stream(query, lambda: _faq_chain(query)):
+        yield chunk
+
 
-        if result and result.get("metadatas") and result["metadatas"][0]:
-            context = " ".join(
-                meta.get("answer", "") for meta in result["metadatas"][0]
-            )
-        else:
-            return (
-                "I don't have specific information about that. "
-                "Please contact our support team or try rephrasing your question."
-            )
+async def _faq_chain(query: str) -> AsyncIterator[str]:
+    try:
+        # Embedding + index search are blocking, keep them off the event loop
+        query_embedding = await asyncio.to_thread(embed_query, query)
 
-        return generate_answer(query, context)
+        # The cache lookup is a small in-memory matrix product, so it runs
+        # inline; retrieval and trimming only start on a miss
+        cached = get_cached_answer(query_embedding)
+        if cached is None:
+            relevant_qa = await asyncio.to_thread(retrieve_context, query_embedding)
 
     except Exception:
-        return (
+        yield (
             "I'm having trouble accessing our FAQ information right now. "
             "Please try again later."
         )
+        return
+
+    if cached is not None:
+        yield cached
+        return
+
+    if relevant_qa:
+        context = build_context(relevant_qa)
+    else:
+        yield NO_CONTEXT_MESSAGE
+        return
+
+    try:
+        chunks = []
+        async for delta in generate_answer(query, context):
+            chunks.append(delta)
+            yield delta
+        answer = "".join(chunks)
+        if answer:
+            cache_answer(query, query_embedding, answer)
+
+    except Exception:
+        yield ANSWER_ERROR_MESSAGE
+
+# ---------------------------------------------------------------------
+# Offline Batch Chain
+# ---------------------------------------------------------------------
+
+def _response_output_text(body: dict) -> str:
+    """Pull the output text out of a raw Responses API JSON body"""
+    return "".join(
+        content["text"]
+        for item in body.get("output", [])
+        if item.get("type") == "message"
+        for content in item.get("content", [])
+        if content.get("type") == "output_text"
+    )
+
+
+async def faq_batch_chain(queries: list[str]) -> list[str]:
+    """Answer many FAQ questions offline through the OpenAI Batch API.
+
+    Meant for bulk jobs such as evaluation runs; batches are half price and
+    drawn from a separate rate-limit pool, but can take up to 24h. Interactive
+    traffic should keep using faq_chain.
+    """
+    answers = [NO_CONTEXT_MESSAGE] * len(queries)
+
+    # Retrieval is cheap, so do it for every query up front in one pass
+    query_embeddings = await asyncio.to_thread(embed, queries)
+    results = await asyncio.to_thread(
+        lambda: [trim_context(qa) for qa in search_faq(query_embeddings)]
+    )
+
+    requests = []
+    for i, (query, metadatas) in enumerate(zip(queries, results)):
+        if not metadatas:
+            continue
+        # Stays an error unless the batch comes back with an answer
+        answers[i] = ANSWER_ERROR_MESSAGE
+        requests.append({
+            "custom_id": str(i),
+            "method": "POST",
+            "url": "/v1/responses",
+            "body": {
+                "model": FAQ_MODEL,
+                "input": build_answer_messages(query, build_context(metadatas)),
+            },
+        })
+
+    if not requests:
+        return answers
+
+    batch_input = "\n".join(json.dumps(request) for request in requests)
+    batch_file = await client.files.create(
+        file=("faq_batch.jsonl", batch_input.encode()),
+        purpose="batch"
+    )
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/responses",
+        completion_window="24h"
+    )
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(batch_poll_interval)
+        batch = await client.batches.retrieve(batch.id)
+
+    if not batch.output_file_id:
+        return answers
+
+    output = await client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        if response.get("status_code") == 200:
+            answers[int(record["custom_id"])] = _response_output_text(response["body"])
+
+    return answers
 
 # ---------------------------------------------------------------------
 # Local Testing
@@ -158,7 +372,10 @@ if __name__ == "__main__":
         "What are your shipping charges?",
     ]
 
-    for q in test_queries:
+    async def main():
+        return await asyncio.gather(*[collect(faq_chain(q)) for q in test_queries])
+
+    for q, answer in zip(test_queries, asyncio.run(main())):
         print("\n" + "=" * 80)
         print("Query:", q)
-        print("Answer:", faq_chain(q))
+        print("Answer:", answer)
@@ -1,5 +1,7 @@
 import streamlit as st
 import time
+import asyncio
+import threading
 from faq import ingest_faq_data, faq_chain
 from sql import sql_chain
 from chitchat import chitchat_chain
@@ -14,6 +16,14 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# One long-lived event loop shared by every session, so the async OpenAI
+# clients keep their connection pools instead of being torn down per query
+@st.cache_resource
+def get_event_loop():
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
 # Initialize Database
 faqs_path = Path(__file__).parent / "resources/faq_data.csv"
 if "db_init" not in st.session_state:
@@ -176,34 +186,53 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 3. LOGIC ---
-def ask(query):
+def pick_chain(query):
     """Route the query to appropriate handler"""
+    route = router(query)
+    if route is None or route.name is None:
+        return chitchat_chain
+    
+    route_name = route.name
+    if route_name == 'faq':
+        return faq_chain
+    elif route_name == 'sql':
+        return sql_chain
+    elif route_name == 'chitchat':
+        return chitchat_chain
+    else:
+        return chitchat_chain
+
+async def next_chunk(stream):
+    """Pull one chunk from a chain's stream, or None once it is finished"""
+    return await anext(stream, None)
+
+def ask(query):
+    """Stream the routed chain's answer, driving it on the shared event loop"""
     try:
-        route = router(query)
-        if route is None or route.name is None:
-            return chitchat_chain(query)
-        
-        route_name = route.name
-        if route_name == 'faq':
-            return faq_chain(query)
-        elif route_name == 'sql':
-            return sql_chain(query)
-        elif route_name == 'chitchat':
-            return chitchat_chain(query)
-        else:
-            return chitchat_chain(query)
+        stream = pick_chain(query)(query)
+        while True:
+            future = asyncio.run_coroutine_threadsafe(next_chunk(stream), get_event_loop())
+            chunk = future.result()
+            if chunk is None:
+                return
+            yield chunk
     except Exception as e:
-        return f"I encountered a slight hiccup: {str(e)}"
+        yield f"I encountered a slight hiccup: {str(e)}"
 
 # --- 4. UI RENDER ---
 
 st.title("🛍️ ShopAssist")
 
 # Display Chat History
-for message in st.session_state.messages:
+for i, message in enumerate(st.session_state.messages):
     avatar = "👤" if message['role'] == "user" else "🦄"
     with st.chat_message(message['role'], avatar=avatar):
-        st.markdown(message['content'])
+        if message['role'] == "assistant" and message['content'] == "...":
+            # Pending answer: stream it in place, then keep the full text
+            last_query = st.session_state.messages[i - 1]["content"]
+            message['content'] = st.write_stream(ask(last_query))
+        else:
+            st.markdown(message['content'])
 
 # --- 5. THE NEW "IN-FLOW" INPUT BOX ---
 # We use st.text_input instead of chat_input so it sits here, at the bottom of the list
@@ -227,17 +256,3 @@ st.text_input(
     label_visibility="collapsed",
     on_change=submit_query
 )
-
-# Process Response (If the last message is "...")
-if st.session_state.messages and st.session_state.messages[-1]["content"] == "...":
-    # Get the actual query from the user (second to last message)
-    last_query = st.session_state.messages[-2]["content"]
-    
-    # Generate Answer
-    response = ask(last_query)
-    
-    # Update the "..." placeholder with the real response
-    st.session_state.messages[-1]["content"] = response
-    
-    # Rerun to show the final result
-    st.rerun()
\ No newline at end of file
@@ -1,21 +1,30 @@
 import os
 import re
+import asyncio
 import sqlite3
-import pandas as pd
+import threading
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
+from typing import AsyncIterator
+from _llm import client, collect, llm_semaphore
+from _cache import LRUCache, normalize_query
 
 # ---------------------------------------------------------------------
 # Setup
 # ---------------------------------------------------------------------
-load_dotenv()
-
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 db_path = Path(__file__).parent / "db.sqlite"
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
+# SQL generation benefits from the stronger model
+SQL_MODEL = os.getenv("SQL_MODEL", "gpt-5-mini")
+
+# Generated SQL keyed by normalized question. Exact matches only: near-duplicate
+# questions ("under" vs "above", "Puma" vs "Nike") need different SQL.
+sql_cache = LRUCache(maxsize=1024)
+
+# One long-lived connection per worker thread (run_sql runs via asyncio.to_thread)
+_local = threading.local()
+
 # ---------------------------------------------------------------------
 # Prompts
 # ---------------------------------------------------------------------
@@ -43,37 +52,23 @@ RULES:
 - Brand search must be case-insensitive using LOWER(brand) LIKE LOWER('%value%')
 - Never use ILIKE
 - Use ORDER BY and LIMIT when the question implies ranking or top results
-- Never generate destructive SQL (DROP, DELETE, UPDATE, INSERT, ALTER)
+- Never generate destructive SQL (DROP, DELETE, UPDATE, INSERT, ALTER, ATTACH, PRAGMA)
 - Output ONLY the SQL inside <SQL></SQL> tags
 """
 
-RESULT_NARRATION_PROMPT = """You are an expert in converting structured product data into natural language.
-
-You will receive:
-- QUESTION
-- DATA (list of products)
-
-RULES:
-- Use ONLY the provided data
-- Do not mention databases, tables, or queries
-- Format each product on a new line as:
-
-1. Product title: Rs. price (discount% off), Rating: rating <product_link>
-
-- If no products exist, say:
-"No products match your request."
-"""
-
 # ---------------------------------------------------------------------
 # Utilities
 # ---------------------------------------------------------------------
 
-UNSAFE_SQL_KEYWORDS = {"DROP", "DELETE", "UPDATE", "INSERT", "ALTER"}
+UNSAFE_SQL_KEYWORDS = {"DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "ATTACH", "PRAGMA"}
+
+# Compiled once; a single alternation scan replaces one search per keyword
+_UNSAFE_RE = re.compile(rf"\b({'|'.join(sorted(UNSAFE_SQL_KEYWORDS))})\b", re.IGNORECASE)
+_SQL_RE = re.compile(r"<SQL>\s*(.*?)\s*</SQL>", re.DOTALL | re.IGNORECASE)
 
 
 def _is_safe_sql(sql: str) -> bool:
-    sql_upper = sql.upper()
-    return not any(re.search(rf"\b{kw}\b", sql_upper) for kw in UNSAFE_SQL_KEYWORDS)
+    return _UNSAFE_RE.search(sql) is None
 
 
 def _requires_limit(sql: str) -> bool:
@@ -82,7 +77,7 @@ def _requires_limit(sql: str) -> bool:
 
 
 def _extract_sql(text: str) -> str | None:
-    match = re.search(r"<SQL>\s*(.*?)\s*</SQL>", text, re.DOTALL | re.IGNORECASE)
+    match = _SQL_RE.search(text)
     return match.group(1).strip() if match else None
 
 
@@ -90,16 +85,22 @@ def _extract_sql(text: str) -> str | None:
 # LLM Calls
 # ---------------------------------------------------------------------
 
-def generate_sql(question: str) -> str:
+async def generate_sql(question: str) -> str:
+    cache_key = normalize_query(question)
+    cached = sql_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     messages = [
         {"role": "system", "content": SQL_GENERATION_PROMPT},
         {"role": "user", "content": question},
     ]
 
-    response = client.responses.create(
-        model="gpt-5-mini",
-        input=messages
-    )
+    async with llm_semaphore:
+        response = await client.responses.create(
+            model=SQL_MODEL,
+            input=messages
+        )
 
     sql = _extract_sql(response.output_text)
 
@@ -115,50 +116,63 @@ def generate_sql(question: str) -> str:
     if DEBUG:
         print("\n[DEBUG] Generated SQL:\n", sql)
 
+    sql_cache.set(cache_key, sql)
     return sql
 
 
-def run_sql(sql: str) -> pd.DataFrame:
-    with sqlite3.connect(db_path) as conn:
-        return pd.read_sql_query(sql, conn)
+def _get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-65536")
+        # The product catalog is read-only for the chatbot
+        conn.execute("PRAGMA query_only=1")
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
+    return conn
 
 
-def narrate_results(question: str, df: pd.DataFrame) -> str:
-    if df.empty:
-        return "No products match your request."
-
-    data = df.to_dict(orient="records")
+def run_sql(sql: str) -> list[dict]:
+    cur = _get_connection().execute(sql)
+    return [dict(row) for row in cur.fetchall()]
 
-    messages = [
-        {"role": "system", "content": RESULT_NARRATION_PROMPT},
-        {
-            "role": "user",
-            "content": f"QUESTION: {question}\nDATA: {data}",
-        },
-    ]
 
-    response = client.responses.create(
-        model="gpt-5-mini",
-        input=messages
-    )
+def narrate_results(question: str, rows: list[dict]) -> str:
+    """Format product rows as a numbered list (no LLM round-trip needed)"""
+    if not rows:
+        return "No products match your request."
 
-    return response.output_text
+    lines = []
+    for i, row in enumerate(rows, start=1):
+        # discount is stored as a fraction, e.g. 0.24 -> 24% off
+        discount = round((row.get("discount") or 0) * 100)
+        rating = row.get("avg_rating") or "N/A"
+        lines.append(
+            f"{i}. {row['title']}: Rs. {row['price']} ({discount}% off), "
+            f"Rating: {rating} {row['product_link']}"
+        )
+    return "\n".join(lines)
 
 
 # ---------------------------------------------------------------------
 # Public Chain
 # ---------------------------------------------------------------------
 
-def sql_chain(question: str) -> str:
+async def sql_chain(question: str) -> AsyncIterator[str]:
+    # Results are formatted locally, so the whole answer arrives as one chunk
     try:
-        sql = generate_sql(question)
-        df = run_sql(sql)
-        return narrate_results(question, df)
+        sql = await generate_sql(question)
+        rows = await asyncio.to_thread(run_sql, sql)
+        answer = narrate_results(question, rows)
 
     except Exception as e:
         if DEBUG:
             print("[ERROR]", e)
-        return "Sorry, I couldn't process your request at the moment."
+        answer = "Sorry, I couldn't process your request at the moment."
+
+    yield answer
 
 
 # ---------------------------------------------------------------------
@@ -173,7 +187,10 @@ if __name__ == "__main__":
         "List products with discount above 40%",
     ]
 
-    for q in tests:
+    async def main():
+        return await asyncio.gather(*[collect(sql_chain(q)) for q in tests])
+
+    for q, answer in zip(tests, asyncio.run(main())):
         print("\n" + "=" * 80)
         print("Query:", q)
-        print(sql_chain(q))
+        print(answer)